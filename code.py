@@ -1,18 +1,23 @@
 import streamlit as st
-import streamlit.components.v1 as components
 import gspread
-from gspread import Cell
+from gspread.exceptions import APIError
+from gspread.utils import a1_range_to_grid_range, absolute_range_name, rowcol_to_a1
 from datetime import datetime
 from google.oauth2.service_account import Credentials
 import time
-import pandas as pd
+import random
+import functools
+import html
 from zoneinfo import ZoneInfo
 
+# Zona horaria de Chile
+TZ = ZoneInfo("America/Santiago")
+
 def get_chile_timestamp():
     """
     Retorna la fecha y hora actual en la zona horaria de Chile con el formato deseado.
     """
-    return datetime.now(ZoneInfo("America/Santiago")).strftime('%d-%m-%y %H:%M')
+    return datetime.now(TZ).strftime('%d-%m-%y %H:%M')
 
 # Configuración de la página
 st.set_page_config(
@@ -24,162 +29,536 @@ st.set_page_config(
 # Configuración: URL de la hoja de cálculo
 SPREADSHEET_URL = st.secrets["spreadsheet_url"]
 
+# Última columna usada por la app (AF: Última actualización)
+LAST_COL = 32
+
+# Máximo de celdas por solicitud de escritura
+MAX_CELLS_PER_WRITE = 40000
+
+# Estados de un proceso que registran fecha al guardarse
+TRUE_STATES = frozenset({'Sí', 'Programado', 'Sí (DropControl)', 'Sí (CDTEC IF)'})
+
 # Función para reiniciar la búsqueda
 def reset_search():
     st.session_state.rows = None
+    st.session_state.selected_sectores = []
 
 # Configuración de credenciales
 scope = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
 ]
-credentials = Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"], scopes=scope
-)
-gc = gspread.authorize(credentials)
-sheet = gc.open_by_url(SPREADSHEET_URL).sheet1
 
-# Manejo de errores de API
-def handle_quota_error(e):
+# Reintentar llamadas a la API con backoff exponencial ante errores transitorios
+RETRY_STATUS_CODES = (429, 500, 503)
+MAX_RETRIES = 5
+
+def with_backoff(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(MAX_RETRIES):
+            try:
+                return fn(*args, **kwargs)
+            except APIError as e:
+                if e.response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES - 1:
+                    raise
+                # Respetar Retry-After si la API lo indica; si no, 1s, 2s, 4s... más jitter
+                retry_after = e.response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt + random.random()
+                time.sleep(min(delay, 32))
+    return wrapper
+
+# Cliente y hoja en caché: se autorizan una sola vez y sobreviven a los reruns
+@st.cache_resource
+@with_backoff
+def get_sheet():
+    credentials = Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"], scopes=scope
+    )
+    gc = gspread.authorize(credentials)
+    return gc.open_by_url(SPREADSHEET_URL).sheet1
+
+sheet = get_sheet()
+
+# Manejo de errores de API (los transitorios ya se reintentaron con with_backoff)
+def api_error_message(e):
     error_str = str(e).lower()
     if "quota" in error_str or "limit" in error_str:
-        st.error("❌ Límite de API alcanzado. Reiniciando...")
-        time.sleep(1)
-        st.rerun()
+        return "❌ Límite de API alcanzado. Intente nuevamente en unos segundos."
+    return f"❌ Error: {e}"
 
-# Obtener datos con caché
+def handle_api_error(e):
+    st.error(api_error_message(e))
+
+# Obtener con caché solo Cuenta y Sector (columnas A:B), lo necesario para los filtros.
+# Se piden por columnas: la respuesta son dos listas planas, sin una lista por fila.
 @st.cache_data(ttl=60)
 def get_data():
     try:
-        return sheet.get_all_values()
+        response = with_backoff(sheet.spreadsheet.values_get)(
+            absolute_range_name(sheet.title, "A2:B"),
+            params={"majorDimension": "COLUMNS"},
+        )
+    except Exception as e:
+        handle_api_error(e)
+        return None
+    columns = response.get("values", []) + [[], []]
+    cuentas, sectores = columns[0], columns[1]
+    n_rows = max(len(cuentas), len(sectores))
+    cuentas += [""] * (n_rows - len(cuentas))
+    sectores += [""] * (n_rows - len(sectores))
+    return list(zip(cuentas, sectores))
+
+# Obtener las filas completas (A:AF) de los registros encontrados en una sola llamada
+def get_rows(rows):
+    try:
+        values = with_backoff(sheet.batch_get)([f"{rowcol_to_a1(row, 1)}:{rowcol_to_a1(row, LAST_COL)}" for row in rows])
     except Exception as e:
-        handle_quota_error(e)
-        st.error(f"❌ Error: {e}")
+        handle_api_error(e)
         return None
+    row_data = {}
+    for row, value_range in zip(rows, values):
+        row_values = value_range[0] if value_range else []
+        row_data[row] = row_values + [""] * (LAST_COL - len(row_values))
+    return row_data
+
+# Indexar las filas por cuenta y sector, una sola vez por carga de datos.
+# Las filas sin cuenta (vacías o de relleno) se omiten.
+def build_cuenta_index(data):
+    cuenta_index = {}
+    for i, (cuenta, sector) in enumerate(data, start=2):
+        if not cuenta:
+            continue
+        cuenta_index.setdefault(cuenta, {}).setdefault(sector, []).append(i)
+    return cuenta_index
+
+# Sectores únicos y ordenados de cada cuenta, calculados una vez por carga de datos
+def build_sectores_index(cuenta_index):
+    return {cuenta: sorted(sectores) for cuenta, sectores in cuenta_index.items()}
 
 # Buscar filas según cuenta y sectores seleccionados
-def find_rows(selected_cuenta, selected_sectores, data):
-    rows = []
-    for i, row in enumerate(data[1:]):
-        match_cuenta = (row[0] == selected_cuenta)
-        match_sector = (len(selected_sectores) == 0 or row[1] in selected_sectores)
-        if match_cuenta and match_sector:
-            rows.append(i + 2)
-    return rows
-
-# Actualizar celdas (incluye actualización de cada proceso)
-def update_steps(rows, steps_updates, consultoria_value, comentarios_value):
+def find_rows(selected_cuenta, selected_sectores, cuenta_index):
+    sectores = cuenta_index.get(selected_cuenta, {})
+    if not selected_sectores:
+        return sorted(row for rows in sectores.values() for row in rows)
+    return sorted(row for sector in set(selected_sectores) for row in sectores.get(sector, []))
+
+# Verificar que las filas descargadas sigan teniendo la cuenta y el sector indexados.
+# Si alguien insertó o borró filas desde la carga, los números de fila ya no apuntan
+# a los mismos registros.
+def rows_match_index(row_data, selected_cuenta, cuenta_index):
+    sector_por_fila = {row: sector
+                       for sector, rows in cuenta_index.get(selected_cuenta, {}).items()
+                       for row in rows}
+    return all(row_data[row][0:2] == [selected_cuenta, sector_por_fila.get(row)]
+               for row in row_data)
+
+# Separar una lista ordenada de columnas en tramos consecutivos
+def column_runs(cols):
+    runs = []
+    for col in cols:
+        if runs and col == runs[-1][-1] + 1:
+            runs[-1].append(col)
+        else:
+            runs.append([col])
+    return runs
+
+# Dividir un rango que supera MAX_CELLS_PER_WRITE celdas en bloques de filas que
+# quepan en una sola solicitud
+def split_value_range(value_range):
+    values = value_range["values"]
+    width = max((len(row) for row in values), default=0)
+    if width * len(values) <= MAX_CELLS_PER_WRITE:
+        return [value_range]
+    grid = a1_range_to_grid_range(value_range["range"])
+    rows_per_block = max(1, MAX_CELLS_PER_WRITE // width)
+    blocks = []
+    for start in range(0, len(values), rows_per_block):
+        block = values[start:start + rows_per_block]
+        first_row = grid["startRowIndex"] + 1 + start
+        blocks.append({
+            "range": f"{rowcol_to_a1(first_row, grid['startColumnIndex'] + 1)}:"
+                     f"{rowcol_to_a1(first_row + len(block) - 1, grid['endColumnIndex'])}",
+            "values": block,
+        })
+    return blocks
+
+# Repartir los rangos en solicitudes de a lo más MAX_CELLS_PER_WRITE celdas,
+# bajo el límite de tamaño que acepta la API en una sola escritura. Los rangos
+# más grandes que el límite se dividen antes por filas.
+def chunk_value_ranges(value_ranges):
+    chunk, cells = [], 0
+    for value_range in value_ranges:
+        for block in split_value_range(value_range):
+            n_cells = sum(len(values) for values in block["values"])
+            if chunk and cells + n_cells > MAX_CELLS_PER_WRITE:
+                yield chunk
+                chunk, cells = [], 0
+            chunk.append(block)
+            cells += n_cells
+    if chunk:
+        yield chunk
+
+# Armar los rangos A1 a escribir: los tramos de columnas de cada fila, y cuando filas
+# consecutivas cambian el mismo tramo, un solo rectángulo que las cubre a todas
+def build_value_ranges(changes_by_row):
+    blocks = {}
+    for row in sorted(changes_by_row):
+        changes = changes_by_row[row]
+        for run in column_runs(sorted(changes)):
+            run_blocks = blocks.setdefault((run[0], run[-1]), [])
+            values = [changes[col] for col in run]
+            if run_blocks and run_blocks[-1][1] == row - 1:
+                run_blocks[-1][1] = row
+                run_blocks[-1][2].append(values)
+            else:
+                run_blocks.append([row, row, [values]])
+    return [
+        {"range": f"{rowcol_to_a1(first_row, first_col)}:{rowcol_to_a1(last_row, last_col)}",
+         "values": values}
+        for (first_col, last_col), run_blocks in blocks.items()
+        for first_row, last_row, values in run_blocks
+    ]
+
+# Actualizar celdas (incluye actualización de cada proceso). Los errores de API se propagan.
+# Solo se escriben las celdas que cambian, agrupadas en rangos rectangulares.
+# Retorna la cantidad de filas modificadas; si no hay cambios no llama a la API.
+def update_steps(rows, steps_updates, consultoria_value, comentarios_value, row_data):
     now = get_chile_timestamp()
-    cells_to_update = []
+    new_values = {}
+    date_step_cols = {}
 
     # Actualizar Consultoría (columna 3)
     consultoria_col = 3
-    update_consultoria = "" if consultoria_value == "Vacío" else consultoria_value
-    for row in rows:
-        cells_to_update.append(Cell(row, consultoria_col, update_consultoria))
+    new_values[consultoria_col] = "" if consultoria_value == "Vacío" else consultoria_value
 
     # Actualizar cada proceso (valor, observación y fecha)
     for step in steps_updates:
         selected_option = step["value"]
         update_value = "" if selected_option == "Vacío" else selected_option
-        step_col = step["step_col"]
-        date_col = step["date_col"]
+        new_values[step["step_col"]] = update_value
         obs_col = step.get("obs_col")
-        for row in rows:
-            cells_to_update.append(Cell(row, step_col, update_value))
-            if obs_col is not None:
-                cells_to_update.append(Cell(row, obs_col, step["obs_value"]))
-            if update_value in ['Sí', 'Programado', 'Sí (DropControl)', 'Sí (CDTEC IF)']:
-                cells_to_update.append(Cell(row, date_col, now))
-            else:
-                cells_to_update.append(Cell(row, date_col, ''))
+        if obs_col is not None:
+            new_values[obs_col] = step["obs_value"]
+        if update_value in TRUE_STATES:
+            new_values[step["date_col"]] = now
+        else:
+            new_values[step["date_col"]] = ''
+        date_step_cols[step["date_col"]] = step["step_col"]
 
     # Actualizar Comentarios generales (columna 31)
     comentarios_col = 31
-    for row in rows:
-        cells_to_update.append(Cell(row, comentarios_col, comentarios_value))
+    new_values[comentarios_col] = comentarios_value
 
     # Actualizar fecha de última modificación (columna 32)
-    ultima_actualizacion_col = 32
+    ultima_actualizacion_col = LAST_COL
+    new_values[ultima_actualizacion_col] = now
+
+    # Comparar con los valores actuales de cada fila. La fecha de un proceso solo se
+    # toca si cambió su valor, y la de última modificación solo si algo cambió
+    changes_by_row = {}
     for row in rows:
-        cells_to_update.append(Cell(row, ultima_actualizacion_col, now))
+        current = row_data[row]
+        changes = {col: value for col, value in new_values.items()
+                   if col != ultima_actualizacion_col and current[col - 1] != value}
+        for date_col, step_col in date_step_cols.items():
+            if step_col not in changes:
+                changes.pop(date_col, None)
+        if changes:
+            changes[ultima_actualizacion_col] = now
+            changes_by_row[row] = changes
+    if not changes_by_row:
+        return 0
+    value_ranges = build_value_ranges(changes_by_row)
+
+    # Sin invalidar cachés: se escribe solo C:AF, y get_data() guarda únicamente A:B.
+    # La respuesta trae los valores ya interpretados por la hoja (fechas, números).
+    # Los límites de cada rango se calculan antes de escribir: batch_update reescribe
+    # el "range" de los dicts que recibe (le antepone el nombre de la hoja), por eso
+    # además se le pasan copias.
+    for chunk in chunk_value_ranges(value_ranges):
+        grids = [a1_range_to_grid_range(value_range["range"]) for value_range in chunk]
+        response = with_backoff(sheet.batch_update)(
+            [dict(value_range) for value_range in chunk],
+            value_input_option='USER_ENTERED',
+            include_values_in_response=True,
+        )
+
+        # Aplicar en memoria lo escrito, tal como quedó en la hoja, sin volver a leer las
+        # filas. Se hace por cada solicitud: si una posterior falla, row_data ya refleja
+        # lo que sí se alcanzó a escribir.
+        for grid, updated in zip(grids, response.get("responses", [])):
+            updated_values = updated.get("updatedData", {}).get("values", [])
+            for r, row in enumerate(range(grid["startRowIndex"] + 1, grid["endRowIndex"] + 1)):
+                values = updated_values[r] if r < len(updated_values) else []
+                for c, col in enumerate(range(grid["startColumnIndex"] + 1, grid["endColumnIndex"] + 1)):
+                    row_data[row][col - 1] = values[c] if c < len(values) else ""
+    return len(changes_by_row)
 
+# Guardar el formulario de actualización. Corre como callback del botón, antes del
+# rerun, así la página se dibuja con los datos ya parcheados sin un st.rerun() extra.
+def save_updates():
+    steps_updates = []
+    for i, proc in enumerate(processes):
+        steps_updates.append({
+            "step_label": proc["name"],
+            "step_col": proc["step_col"],
+            "obs_col": proc["obs_col"],
+            "date_col": proc["date_col"],
+            "value": st.session_state[f"process_{i}_update"],
+            "obs_value": st.session_state[f"obs_{i}_update"]
+        })
+    comentarios_generales_value = st.session_state.get("comentarios_generales_update", "")
     try:
-        sheet.update_cells(cells_to_update, value_input_option='USER_ENTERED')
-        st.success("✅ Cambios guardados.")
-        st.cache_data.clear()
-        return True
+        updated_rows = update_steps(st.session_state.rows, steps_updates, st.session_state.consultoria_update,
+                                    comentarios_generales_value, st.session_state.row_data)
+        if updated_rows:
+            st.session_state.save_result = ("success", f"✅ Cambios guardados en {updated_rows} sector(es).")
+        else:
+            st.session_state.save_result = ("info", "ℹ️ No hay cambios que guardar.")
     except Exception as e:
-        handle_quota_error(e)
-        st.error(f"❌ Error: {e}")
-        return False
-
-# Obtener color según estado
-def get_state_color(state):
-    colors = {
-        'Sí': '#4CAF50',          # Verde
-        'No': '#F44336',          # Rojo
-        'Programado': '#FFC107',  # Amarillo
-        'No aplica': '#9E9E9E',   # Gris
-        'Sí (DropControl)': '#2196F3',   # Azul
-        'Sí (CDTEC IF)': '#673AB7',      # Morado
-        'Vacío': '#E0E0E0',       # Gris claro
-    }
-    return colors.get(state, '#E0E0E0')
+        st.session_state.save_result = ("error", api_error_message(e))
+
+# Texto a mostrar de una celda: sin espacios sobrantes, o "Vacío" si está en blanco
+def display_value(value):
+    value = value.strip()
+    return value if value else "Vacío"
+
+# Opciones del campo Consultoría
+CONSULTORIA_OPTIONS = ("Sí", "No")
+
+# Opciones de un selectbox y el índice del valor actual; si el valor no es una de
+# las opciones se agrega al inicio. Memoizado: los mismos pares se repiten en cada rerun.
+@functools.lru_cache(maxsize=256)
+def select_options(options, current):
+    if current not in options:
+        options = (current,) + options
+    return options, options.index(current)
+
+# Colores por estado (tabla constante, se construye una sola vez)
+STATE_COLORS = {
+    'Sí': '#4CAF50',          # Verde
+    'No': '#F44336',          # Rojo
+    'Programado': '#FFC107',  # Amarillo
+    'No aplica': '#9E9E9E',   # Gris
+    'Sí (DropControl)': '#2196F3',   # Azul
+    'Sí (CDTEC IF)': '#673AB7',      # Morado
+    'Vacío': '#E0E0E0',       # Gris claro
+}
+DEFAULT_STATE_COLOR = '#E0E0E0'
+
+# Celda de estado para un valor y su color
+def status_cell_html(state, color):
+    return f'<td><div class="status-cell" style="background-color: {color};">{html.escape(state)}</div></td>'
+
+# Celdas de estado precalculadas para los estados conocidos
+STATE_CELL_HTML = {state: status_cell_html(state, color) for state, color in STATE_COLORS.items()}
 
 # Definición centralizada de procesos.
 processes = [
-    {"name": "Proceso Nuevo 1", "step_col": 4, "obs_col": 5, "date_col": 6, "options": ['Sí', 'No']},
-    {"name": "Proceso Nuevo 2", "step_col": 7, "obs_col": 8, "date_col": 9, "options": ['Sí', 'No', 'Programado']},
-    {"name": "Ingreso a Planilla Clientes Nuevos", "step_col": 10, "obs_col": 11, "date_col": 12, "options": ['Sí', 'No']},
-    {"name": "Correo Presentación y Solicitud Información", "step_col": 13, "obs_col": 14, "date_col": 15, "options": ['Sí', 'No', 'Programado']},
-    {"name": "Agregar Puntos Críticos", "step_col": 16, "obs_col": 17, "date_col": 18, "options": ['Sí', 'No']},
-    {"name": "Generar Capacitación Plataforma", "step_col": 19, "obs_col": 20, "date_col": 21, "options": ['Sí (DropControl)', 'Sí (CDTEC IF)', 'No', 'Programado']},
-    {"name": "Generar Documento Power BI", "step_col": 22, "obs_col": 23, "date_col": 24, "options": ['Sí', 'No', 'Programado', 'No aplica']},
-    {"name": "Generar Capacitación Power BI", "step_col": 25, "obs_col": 26, "date_col": 27, "options": ['Sí', 'No', 'Programado', 'No aplica']},
-    {"name": "Generar Estrategia de Riego", "step_col": 28, "obs_col": 29, "date_col": 30, "options": ['Sí', 'No', 'Programado', 'No aplica']}
+    {"name": "Proceso Nuevo 1", "step_col": 4, "obs_col": 5, "date_col": 6, "options": ('Sí', 'No')},
+    {"name": "Proceso Nuevo 2", "step_col": 7, "obs_col": 8, "date_col": 9, "options": ('Sí', 'No', 'Programado')},
+    {"name": "Ingreso a Planilla Clientes Nuevos", "step_col": 10, "obs_col": 11, "date_col": 12, "options": ('Sí', 'No')},
+    {"name": "Correo Presentación y Solicitud Información", "step_col": 13, "obs_col": 14, "date_col": 15, "options": ('Sí', 'No', 'Programado')},
+    {"name": "Agregar Puntos Críticos", "step_col": 16, "obs_col": 17, "date_col": 18, "options": ('Sí', 'No')},
+    {"name": "Generar Capacitación Plataforma", "step_col": 19, "obs_col": 20, "date_col": 21, "options": ('Sí (DropControl)', 'Sí (CDTEC IF)', 'No', 'Programado')},
+    {"name": "Generar Documento Power BI", "step_col": 22, "obs_col": 23, "date_col": 24, "options": ('Sí', 'No', 'Programado', 'No aplica')},
+    {"name": "Generar Capacitación Power BI", "step_col": 25, "obs_col": 26, "date_col": 27, "options": ('Sí', 'No', 'Programado', 'No aplica')},
+    {"name": "Generar Estrategia de Riego", "step_col": 28, "obs_col": 29, "date_col": 30, "options": ('Sí', 'No', 'Programado', 'No aplica')}
 ]
 
+# Estilos de la tabla de estado (constantes; solo la altura varía entre renders)
+STATUS_TABLE_CSS = """
+<style>
+.status-table {
+    width: 100%;
+    border-collapse: collapse;
+    color: #31333F;
+    background-color: #ffffff;
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
+}
+.status-table th, .status-table td {
+    border: 1px solid #ddd;
+    padding: 8px;
+    text-align: center;
+}
+.status-table th {
+    background-color: #f2f2f2;
+    position: sticky;
+    top: 0;
+}
+.status-table tr:nth-child(even) {
+    background-color: #f9f9f9;
+}
+.status-cell {
+    border-radius: 4px;
+    color: white;
+    padding: 4px 8px;
+    display: inline-block;
+    width: 90%;
+    text-align: center;
+}
+.date-cell {
+    font-size: 0.85em;
+    color: #333;
+}
+</style>
+"""
+
+# Construir el HTML de la tabla de estado. En caché (acotada, porque cada guardado
+# genera una clave nueva): mientras las filas mostradas no cambien, los reruns
+# reutilizan el mismo string. Se arma como lista de fragmentos y se une una sola vez
+# al final, sin saltos ni sangría para que st.markdown no lo interprete como bloque
+# de código. El texto de la planilla se escapa: la tabla va directo en la página.
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_status_html(headers, table_data, estado_height):
+    parts = [f'<div style="height: {estado_height}px; overflow-y: auto;">',
+             '<table class="status-table"><thead><tr>']
+    for header in headers:
+        parts.append(f"<th>{html.escape(header)}</th>")
+    parts.append("</tr></thead><tbody>")
+    for row in table_data:
+        parts.append("<tr>")
+        for i, cell in enumerate(row):
+            if i <= 1:
+                parts.append(f"<td>{html.escape(cell)}</td>")
+            elif i == len(row) - 1:
+                parts.append(f'<td><div class="date-cell">{html.escape(cell)}</div></td>')
+            else:
+                cell_value = display_value(cell)
+                cell_html = STATE_CELL_HTML.get(cell_value)
+                if cell_html is None:
+                    cell_html = status_cell_html(cell_value, DEFAULT_STATE_COLOR)
+                parts.append(cell_html)
+        parts.append("</tr>")
+    parts.append("</tbody></table></div>")
+    return "".join(parts)
+
+# Pestañas de la búsqueda actual. Como fragmento, los cambios de sus widgets
+# (selector de observaciones, guardado) vuelven a ejecutar solo esta parte.
+@st.fragment
+def render_tabs(rows, row_data):
+    tab1, tab2 = st.tabs(["📊 Estado Actual", "📝 Actualizar Registro"])
+    
+    with tab1:
+        st.header("Procesos")
+        headers = ["Cuenta", "Sector", "Consultoría"] + [p["name"] for p in processes] + ["Última Actualización"]
+        table_data = []
+        for row_index in rows:
+            row = row_data[row_index]
+            # Las filas vienen completadas hasta LAST_COL: se indexan sin verificar largo
+            table_data.append((row[0], row[1], row[2],
+                               *(row[proc["step_col"] - 1] for proc in processes),
+                               row[LAST_COL - 1]))
+        
+        n_rows = len(table_data)
+        if n_rows <= 3:
+            estado_height = 230
+        elif n_rows <= 10:
+            estado_height = 285
+        else:
+            estado_height = 500
+        
+        # Tuplas inmutables: claves de caché baratas de hashear
+        html_table = build_status_html(tuple(headers), tuple(table_data), estado_height)
+        st.markdown(html_table, unsafe_allow_html=True)
+
+        st.subheader("Observaciones")
+        # Mapear cada sector presente en las filas seleccionadas a su primera fila
+        fila_por_sector = {}
+        for r in rows:
+            fila_por_sector.setdefault(row_data[r][1], r)
+        if len(fila_por_sector) > 1:
+            filas_observ = [fila_por_sector[sector] for sector in sorted(fila_por_sector)]
+            chosen_row = st.selectbox("Seleccione el sector para ver observaciones:", filas_observ,
+                                      format_func=lambda r: row_data[r][1], key="observ_sector_select")
+            fila_datos = row_data[chosen_row]
+        else:
+            fila_datos = row_data[rows[0]]
+        
+        general_comment = display_value(fila_datos[30])
+        with st.expander("Comentarios Generales", expanded=True):
+            st.write(general_comment)
+        for proc in processes:
+            with st.expander(proc["name"], expanded=True):
+                st.write(display_value(fila_datos[proc["obs_col"] - 1]))
+    
+    with tab2:
+        with st.form("update_form"):
+            st.header("Actualizar Registro")
+            fila_datos = row_data[rows[0]]
+            
+            # Dividir el formulario en dos columnas
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                # Campo de Consultoría
+                consultoria_options, consultoria_index = select_options(CONSULTORIA_OPTIONS, display_value(fila_datos[2]))
+                st.selectbox("Consultoría", options=consultoria_options, index=consultoria_index, key="consultoria_update")
+                
+                # Campos dinámicos para los valores de cada proceso
+                for i, proc in enumerate(processes):
+                    options_for_select, default_index = select_options(
+                        proc["options"], display_value(fila_datos[proc["step_col"] - 1]))
+                    st.selectbox(proc["name"], options=options_for_select, index=default_index, key=f"process_{i}_update")
+            
+            with col2:
+                # Campos dinámicos para las observaciones de cada proceso
+                for i, proc in enumerate(processes):
+                    default_obs = fila_datos[proc["obs_col"] - 1]
+                    st.text_area(f"Observaciones - {proc['name']}", value=default_obs, height=68, key=f"obs_{i}_update")
+                
+                # Comentarios generales
+                st.text_area("Comentarios generales", value="", height=68, key="comentarios_generales_update")
+            
+            st.form_submit_button("Guardar Cambios", on_click=save_updates)
+
+            # Resultado del último guardado
+            save_result = st.session_state.pop("save_result", None)
+            if save_result is not None:
+                kind, message = save_result
+                if kind == "success":
+                    st.success(message)
+                elif kind == "info":
+                    st.info(message)
+                else:
+                    st.error(message)
+
 def main():
     st.title("📌 Estado de Clientes")
+    # Estilos de la tabla de estado, inyectados una sola vez en la página
+    st.markdown(STATUS_TABLE_CSS, unsafe_allow_html=True)
     
     # Botón para abrir la planilla de Google
-    html_button = f"""
-    <div style="text-align: left; margin-bottom: 10px;">
-        <a href="{SPREADSHEET_URL}" target="_blank">
-            <button style="
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                padding: 5px 10px;
-                text-align: center;
-                text-decoration: none;
-                display: inline-block;
-                font-size: 14px;
-                border-radius: 5px;
-                cursor: pointer;">
-                Abrir Planilla de Google
-            </button>
-        </a>
-    </div>
-    """
-    components.html(html_button, height=50)
+    st.link_button("Abrir Planilla de Google", SPREADSHEET_URL)
 
-    # Inicializar estado de actualizaciones
-    if "update_successful" not in st.session_state:
-        st.session_state.update_successful = False
+    # Índice desfasado detectado en la última búsqueda: la cuenta y los sectores
+    # elegidos pueden no existir en los datos recargados
+    if st.session_state.pop("index_outdated", False):
+        reset_search()
+        st.session_state.cuenta = "Seleccione una cuenta"
+        st.warning("⚠️ La planilla cambió desde la última carga: datos recargados, vuelva a buscar.")
 
-    # Cargar datos (se recargan si hubo una actualización exitosa)
-    if "data" not in st.session_state or st.session_state.update_successful:
-        st.session_state.data = get_data()
-        st.session_state.update_successful = False
-    data = st.session_state.data
+    # Recarga explícita desde la planilla
+    if st.button("🔄 Recargar datos"):
+        get_data.clear()
+        st.session_state.cuenta_index = None
+        reset_search()
 
-    if data is None:
+    # Cargar datos e indexarlos (tras guardar se parchean en memoria, sin recargar la hoja)
+    if st.session_state.get("cuenta_index") is None:
+        data = get_data()
+        if data is not None:
+            st.session_state.cuenta_index = build_cuenta_index(data)
+            st.session_state.sectores_index = build_sectores_index(st.session_state.cuenta_index)
+            st.session_state.unique_cuentas = sorted(st.session_state.cuenta_index)
+    cuenta_index = st.session_state.get("cuenta_index")
+
+    if cuenta_index is None:
         st.stop()
 
-    # Extraer cuentas únicas
-    unique_cuentas = sorted(set(row[0] for row in data[1:]))
+    # Cuentas únicas (ordenadas una vez por carga de datos)
+    unique_cuentas = st.session_state.unique_cuentas
 
     st.header("Buscar Registro")
     
@@ -189,249 +568,53 @@ def main():
     
     # Selección múltiple de Sectores
     if selected_cuenta != "Seleccione una cuenta":
-        sectores_para_cuenta = [row[1] for row in data[1:] if row[0] == selected_cuenta]
-        unique_sectores = sorted(set(sectores_para_cuenta))
-        
-        if "selected_sectores" not in st.session_state:
-            st.session_state.selected_sectores = []
-            
-        st.write("Sectores de Riego (seleccione uno o varios):")
-        checkbox_container = st.container()
-
-        if st.button("Seleccionar Todos", use_container_width=True):
-            st.session_state.selected_sectores = unique_sectores.copy()
-            st.rerun()
-        
-        with checkbox_container:
-            for sector in unique_sectores:
-                sector_checked = st.checkbox(sector, key=f"sector_{sector}", 
-                                             value=sector in st.session_state.selected_sectores)
-                if sector_checked and sector not in st.session_state.selected_sectores:
-                    st.session_state.selected_sectores.append(sector)
-                elif not sector_checked and sector in st.session_state.selected_sectores:
-                    st.session_state.selected_sectores.remove(sector)
-        
-        if st.button("Deseleccionar Todos", use_container_width=True):
-            st.session_state.selected_sectores = []
-            st.rerun()
+        unique_sectores = st.session_state.sectores_index[selected_cuenta]
     else:
-        st.session_state.selected_sectores = []
+        unique_sectores = []
+
+    # El selector va en un formulario: elegir sectores no provoca un rerun
+    # por cada clic, solo al presionar "Buscar Registro"
+    with st.form("buscar_form", border=False):
+        st.multiselect("Sectores de Riego (vacío para ver todos):", unique_sectores, key="selected_sectores")
+        buscar = st.form_submit_button("Buscar Registro", type="primary", use_container_width=True)
 
     # Botón para buscar el registro
-    if st.button("Buscar Registro", type="primary", use_container_width=True):
+    if buscar:
         if selected_cuenta == "Seleccione una cuenta":
             st.error("❌ Seleccione una cuenta válida.")
             st.session_state.rows = None
-        elif not st.session_state.selected_sectores:
-            st.warning("⚠️ No hay sectores seleccionados. Se mostrarán todos los sectores para esta cuenta.")
-            rows = find_rows(selected_cuenta, [], data)
-            if not rows:
-                st.error("❌ No se encontraron registros.")
-                st.session_state.rows = None
-            else:
-                st.session_state.rows = rows
-                st.success(f"Se actualizarán {len(rows)} sector(es).")
         else:
-            rows = find_rows(selected_cuenta, st.session_state.selected_sectores, data)
+            selected_sectores = st.session_state.selected_sectores
+            if not selected_sectores:
+                st.warning("⚠️ No hay sectores seleccionados. Se mostrarán todos los sectores para esta cuenta.")
+            rows = find_rows(selected_cuenta, selected_sectores, cuenta_index)
             if not rows:
                 st.error("❌ No se encontraron registros.")
                 st.session_state.rows = None
             else:
-                st.session_state.rows = rows
-                st.success(f"Se actualizarán {len(rows)} sector(es).")
+                # Descargar el detalle solo de las filas encontradas
+                st.session_state.row_data = get_rows(rows)
+                if st.session_state.row_data is None:
+                    st.session_state.rows = None
+                elif not rows_match_index(st.session_state.row_data, selected_cuenta, cuenta_index):
+                    # El índice quedó desfasado: se descarta y el rerun lo recarga desde la
+                    # hoja, limpiando la selección antes de dibujar los widgets
+                    get_data.clear()
+                    st.session_state.cuenta_index = None
+                    st.session_state.rows = None
+                    st.session_state.index_outdated = True
+                    st.rerun()
+                else:
+                    st.session_state.rows = rows
+                    st.success(f"Se actualizarán {len(rows)} sector(es).")
 
     if "rows" not in st.session_state:
         st.session_state.rows = None
 
     # Pestañas para "Estado Actual" y "Actualizar Registro"
     if st.session_state.rows is not None:
-        tab1, tab2 = st.tabs(["📊 Estado Actual", "📝 Actualizar Registro"])
-        
-        with tab1:
-            st.header("Procesos")
-            headers = ["Cuenta", "Sector", "Consultoría"] + [p["name"] for p in processes] + ["Última Actualización"]
-            table_data = []
-            for row_index in st.session_state.rows:
-                row = data[row_index - 1]
-                row_data = [row[0], row[1], row[2]]
-                for proc in processes:
-                    cell_val = row[proc["step_col"] - 1] if len(row) >= proc["step_col"] else ""
-                    row_data.append(cell_val)
-                row_data.append(row[31] if len(row) > 31 else "")
-                table_data.append(row_data)
-            
-            n_rows = len(table_data)
-            if n_rows <= 3:
-                estado_height = 230
-            elif n_rows <= 10:
-                estado_height = 285
-            else:
-                estado_height = 500
-            
-            df = pd.DataFrame(table_data, columns=headers)
-            
-            html_table = f"""
-            <style>
-            .status-table {{
-                width: 100%;
-                border-collapse: collapse;
-                font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
-            }}
-            .status-table th, .status-table td {{
-                border: 1px solid #ddd;
-                padding: 8px;
-                text-align: center;
-            }}
-            .status-table th {{
-                background-color: #f2f2f2;
-                position: sticky;
-                top: 0;
-            }}
-            .status-table tr:nth-child(even) {{
-                background-color: #f9f9f9;
-            }}
-            .status-cell {{
-                border-radius: 4px;
-                color: white;
-                padding: 4px 8px;
-                display: inline-block;
-                width: 90%;
-                text-align: center;
-            }}
-            .date-cell {{
-                font-size: 0.85em;
-                color: #333;
-            }}
-            </style>
-            <div style="height: {estado_height}px; overflow-y: auto;">
-            <table class="status-table">
-                <thead>
-                    <tr>
-            """
-            for header in headers:
-                html_table += f"<th>{header}</th>"
-            html_table += """
-                    </tr>
-                </thead>
-                <tbody>
-            """
-            for _, row in df.iterrows():
-                html_table += "<tr>"
-                for i, cell in enumerate(row):
-                    if i <= 1:
-                        html_table += f"<td>{cell}</td>"
-                    elif i == len(row) - 1:
-                        html_table += f'<td><div class="date-cell">{cell}</div></td>'
-                    else:
-                        cell_value = cell if cell and cell.strip() != "" else "Vacío"
-                        color = get_state_color(cell_value)
-                        html_table += f"""
-                        <td>
-                            <div class="status-cell" style="background-color: {color};">
-                                {cell_value}
-                            </div>
-                        </td>
-                        """
-                html_table += "</tr>"
-            html_table += """
-                </tbody>
-            </table>
-            </div>
-            """
-            st.components.v1.html(html_table, height=estado_height)
-
-            st.subheader("Observaciones")
-            # Extraer los sectores presentes en las filas seleccionadas
-            sectores_observ = []
-            for r in st.session_state.rows:
-                if len(data[r-1]) > 1:
-                    sectores_observ.append(data[r-1][1])
-            sectores_observ = sorted(set(sectores_observ))
-            if len(sectores_observ) > 1:
-                chosen_sector = st.selectbox("Seleccione el sector para ver observaciones:", sectores_observ, key="observ_sector_select")
-                chosen_row = None
-                for r in st.session_state.rows:
-                    if data[r-1][1] == chosen_sector:
-                        chosen_row = r
-                        break
-                if chosen_row is None:
-                    st.error("No se encontró la fila para el sector seleccionado.")
-                    fila_datos = None
-                else:
-                    fila_datos = data[chosen_row - 1]
-            else:
-                fila_datos = data[st.session_state.rows[0] - 1]
-            
-            if fila_datos:
-                general_comment = fila_datos[30] if len(fila_datos) > 30 and fila_datos[30].strip() != "" else "Vacío"
-                with st.expander("Comentarios Generales", expanded=True):
-                    st.write(general_comment)
-                for proc in processes:
-                    obs_index = proc["obs_col"] - 1
-                    obs_value = fila_datos[obs_index] if len(fila_datos) > obs_index and fila_datos[obs_index].strip() != "" else "Vacío"
-                    with st.expander(proc["name"], expanded=True):
-                        st.write(obs_value)
-        
-        with tab2:
-            with st.form("update_form"):
-                st.header("Actualizar Registro")
-                fila_index = st.session_state.rows[0] - 1
-                fila_datos = data[fila_index]
-                
-                # Dividir el formulario en dos columnas
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    # Campo de Consultoría
-                    consultoria_default = fila_datos[2] if len(fila_datos) >= 3 else ""
-                    display_consultoria = consultoria_default.strip() if consultoria_default and consultoria_default.strip() != "" else "Vacío"
-                    consultoria_options = ["Sí", "No"]
-                    if display_consultoria not in consultoria_options:
-                        consultoria_options = [display_consultoria] + consultoria_options
-                    try:
-                        consultoria_index = consultoria_options.index(display_consultoria)
-                    except ValueError:
-                        consultoria_index = 0
-                    consultoria_value = st.selectbox("Consultoría", options=consultoria_options, index=consultoria_index, key="consultoria_update")
-                    
-                    # Campos dinámicos para los valores de cada proceso
-                    process_values = {}
-                    for i, proc in enumerate(processes):
-                        default_val = fila_datos[proc["step_col"] - 1] if len(fila_datos) >= proc["step_col"] else ""
-                        display_val = default_val.strip() if default_val and default_val.strip() != "" else "Vacío"
-                        options_for_select = proc["options"].copy()
-                        if display_val not in options_for_select:
-                            options_for_select = [display_val] + options_for_select
-                        default_index = options_for_select.index(display_val)
-                        process_values[proc["name"]] = st.selectbox(proc["name"], options=options_for_select, index=default_index, key=f"process_{i}_update")
-                
-                with col2:
-                    # Campos dinámicos para las observaciones de cada proceso
-                    process_obs_values = {}
-                    for i, proc in enumerate(processes):
-                        default_obs = fila_datos[proc["obs_col"] - 1] if len(fila_datos) >= proc["obs_col"] else ""
-                        process_obs_values[proc["name"]] = st.text_area(f"Observaciones - {proc['name']}", value=default_obs, height=68, key=f"obs_{i}_update")
-                    
-                    # Comentarios generales
-                    comentarios_generales = st.text_area("Comentarios generales", value="", height=68, key="comentarios_generales_update")
-                
-                submitted = st.form_submit_button("Guardar Cambios")
-                if submitted:
-                    steps_updates = []
-                    for proc in processes:
-                        steps_updates.append({
-                            "step_label": proc["name"],
-                            "step_col": proc["step_col"],
-                            "obs_col": proc["obs_col"],
-                            "date_col": proc["date_col"],
-                            "value": process_values[proc["name"]],
-                            "obs_value": process_obs_values[proc["name"]]
-                        })
-                    comentarios_generales_value = st.session_state.get("comentarios_generales_update", "")
-                    success = update_steps(st.session_state.rows, steps_updates, consultoria_value, comentarios_generales_value)
-                    if success:
-                        st.session_state.update_successful = True
-                        st.rerun()
+        render_tabs(st.session_state.rows, st.session_state.row_data)
+
 
 if __name__ == "__main__":
     main()
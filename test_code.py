@@ -0,0 +1,50 @@
+import ast
+from pathlib import Path
+
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+# code.py arranca la app de Streamlit al importarse; se cargan solo las funciones puras
+CODE = ast.parse(Path(__file__).with_name("code.py").read_text(encoding="utf-8"))
+MAX_CELLS_PER_WRITE = 40000
+
+
+def load_functions(*names):
+    module = ast.Module(
+        body=[node for node in CODE.body if isinstance(node, ast.FunctionDef) and node.name in names],
+        type_ignores=[],
+    )
+    namespace = {
+        "a1_range_to_grid_range": a1_range_to_grid_range,
+        "rowcol_to_a1": rowcol_to_a1,
+        "MAX_CELLS_PER_WRITE": MAX_CELLS_PER_WRITE,
+    }
+    exec(compile(module, "code.py", "exec"), namespace)
+    return namespace
+
+
+def test_chunk_value_ranges_splits_a_range_larger_than_the_limit():
+    functions = load_functions("split_value_range", "chunk_value_ranges")
+    n_rows, width = 1500, 30
+    values = [[f"{row}-{col}" for col in range(width)] for row in range(n_rows)]
+    value_range = {
+        "range": f"{rowcol_to_a1(2, 3)}:{rowcol_to_a1(n_rows + 1, width + 2)}",
+        "values": values,
+    }
+
+    chunks = list(functions["chunk_value_ranges"]([value_range]))
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert sum(len(row) for block in chunk for row in block["values"]) <= MAX_CELLS_PER_WRITE
+
+    # Los bloques cubren exactamente las filas originales, en orden y sin huecos
+    blocks = [block for chunk in chunks for block in chunk]
+    next_row = 2
+    for block in blocks:
+        grid = a1_range_to_grid_range(block["range"])
+        assert grid["startRowIndex"] + 1 == next_row
+        assert grid["endRowIndex"] - grid["startRowIndex"] == len(block["values"])
+        assert (grid["startColumnIndex"] + 1, grid["endColumnIndex"]) == (3, width + 2)
+        next_row = grid["endRowIndex"] + 1
+    assert next_row == n_rows + 2
+    assert [row for block in blocks for row in block["values"]] == values